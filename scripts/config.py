@@ -15,12 +15,31 @@ OPENSEARCH_LOGIN    = os.getenv("OPENSEARCH_LOGIN", "")
 OPENSEARCH_PASSWORD = os.getenv("OPENSEARCH_PASSWORD", "")
 OPENSEARCH_AUTH     = (OPENSEARCH_LOGIN, OPENSEARCH_PASSWORD)
 OPENSEARCH_INDEX    = os.getenv("OPENSEARCH_INDEX", "")
+# Чтение из сводки соединений (индексы connections-*) вместо агрегации firewall-*
+OPENSEARCH_SUMMARY  = os.getenv("OPENSEARCH_SUMMARY", "false").lower() in ("1", "true", "yes")
+
+# Шарды для нескольких роутеров: "index_pattern=neo4j_db,..."
+# Если не заданы - используются OPENSEARCH_INDEX и NEO4J_DB
+SHARDS              = os.getenv("SHARDS", "")
+SHARD_WORKERS       = int(os.getenv("SHARD_WORKERS", "0"))
 
 # Реквизиты Threat Inteligence Portal
 TIP_URL         = os.getenv("TIP_URL", "")
 TIP_WAIT_TIME   = 0.5
 TIP_AUTH_TOKEN  = os.getenv("TIP_AUTH_TOKEN", "")
 
+# Планирование поиска IoC (0 - без ограничения / без кэша)
+# Планировщик включается, если задан TTL кэша, бюджет или TIP_DOMAIN_FIRST
+TIP_STATE_FILE      = os.getenv("TIP_STATE_FILE", "tip_state.json")
+TIP_CACHE_TTL       = int(os.getenv("TIP_CACHE_TTL", "0"))
+TIP_TIME_BUDGET     = float(os.getenv("TIP_TIME_BUDGET", "0"))
+TIP_REQUEST_BUDGET  = int(os.getenv("TIP_REQUEST_BUDGET", "0"))
+# Время хранения отложенных значений, сек
+TIP_PENDING_TTL     = int(os.getenv("TIP_PENDING_TTL", "86400"))
+# Поиск доменов раньше IP; IP из графа домена не ищутся в текущем запуске
+# и, при заданном TIP_CACHE_TTL, в следующих до истечения TTL
+TIP_DOMAIN_FIRST    = os.getenv("TIP_DOMAIN_FIRST", "false").lower() in ("1", "true", "yes")
+
 # Реквизиты Neo4j
 NEO4J_URI       = os.getenv("NEO4J_URI", "")
 NEO4J_LOGIN     = os.getenv("NEO4J_LOGIN", "")
@@ -28,6 +47,18 @@ NEO4J_PASSWORD  = os.getenv("NEO4J_PASSWORD", "")
 NEO4J_AUTH      = (NEO4J_LOGIN, NEO4J_PASSWORD)
 NEO4J_DB        = os.getenv("NEO4J_DB", "")
 
+# Свертка IP без угроз в ноды Network/Asn: "", "network" или "asn"
+GRAPH_ROLLUP        = os.getenv("GRAPH_ROLLUP", "").strip().lower() or None
+GRAPH_ROLLUP_PREFIX = int(os.getenv("GRAPH_ROLLUP_PREFIX", "24"))
+if GRAPH_ROLLUP not in (None, "network", "asn"):
+    raise ValueError(f'Unknown GRAPH_ROLLUP "{GRAPH_ROLLUP}", expected "", "network" or "asn"')
+
+# Параметры профилирования
+PROFILE_ENABLED         = os.getenv("PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR             = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_TOP_N           = int(os.getenv("PROFILE_TOP_N", "25"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0"))
+
 # Параметры логгирования
 import logging
 
@@ -1,11 +1,18 @@
-import neo4j, logging
+import neo4j, logging, ipaddress
+from profiler import Profiler
 
 class GraphDB:
-    def __init__(self, uri: str, auth: tuple, db: str, logger=logging.getLogger("GraphDB")):
-        self._uri    = uri
-        self._auth   = auth
-        self._db     = db
-        self._logger = logger
+    def __init__(self, uri: str, auth: tuple, db: str, logger=logging.getLogger("GraphDB"), profiler=None,
+                 rollup=None, rollup_prefix=24):
+        self._uri      = uri
+        self._auth     = auth
+        self._db       = db
+        self._logger   = logger
+        self._profiler = profiler if profiler else Profiler()
+        
+        # Режим свертки IP без угроз: None, 'network' или 'asn'
+        self._rollup        = rollup
+        self._rollup_prefix = rollup_prefix
         
     def _get_driver(self) -> neo4j.Driver:
         return neo4j.GraphDatabase.driver(self._uri,
@@ -111,7 +118,103 @@ class GraphDB:
         self._logger.info('Done')
         
             
-    def _parse_traffic_data(self, td: list, nodes: dict, relations: list, str_no_dns: str):
+    def _is_flagged(self, ioc: dict) -> bool:
+        """Проверка, что TIP отметил объект как угрозу
+
+        Args:
+            ioc (dict): Данные об IoC
+
+        Returns:
+            bool: `True` - если в графе IoC есть индикатор, ВПО, ненулевая оценка,
+                  попадание в черные списки или выходной узел Tor
+        """
+        for graph_item in ioc['graph']['objects']:
+            if graph_item['type'] in ['indicator', 'malware']:
+                return True
+            if graph_item['type'] != 'malware-analysis':
+                continue
+            
+            item_name = graph_item.get('name', '')
+            result    = graph_item.get('result')
+            if 'score' in item_name:
+                if isinstance(result, dict) and result.get('positives', 0):
+                    return True
+            elif item_name in ['Blacklists', 'Tor exit node']:
+                # Результат может быть списком совпадений, счетчиком или флагом
+                if isinstance(result, dict):
+                    if result.get('positives', result.get('detected', 0)):
+                        return True
+                elif result:
+                    return True
+        return False
+    
+    def _rollup_node(self, ip: str, ioc: dict) -> tuple:
+        """Определение ноды свертки для IP
+
+        Args:
+            ip (str): IP адрес
+            ioc (dict): Данные об IoC или `None`
+
+        Returns:
+            tuple: Тип ноды, имя и свойства. `None` - если свернуть нельзя
+        """
+        details = ioc['details']['basic'] if ioc else {}
+        
+        if self._rollup == 'asn' and details.get('asn'):
+            asn = str(details['asn'])
+            asn = asn if asn.upper().startswith('AS') else f'AS{asn}'
+            return 'asn', asn.upper(), {'as_owner': details.get('as_owner')}
+        if details.get('network'):
+            return 'network', details['network'], {}
+        
+        # Без данных TIP - сеть по префиксу
+        try:
+            network = ipaddress.IPv4Network(f'{ip}/{self._rollup_prefix}', strict=False)
+        except ValueError:
+            return None
+        return 'network', str(network), {}
+    
+    def _build_rollup(self, td: list, iocs: dict) -> tuple[dict, dict]:
+        """Составление свертки IP адресов без угроз в ноды сетей или AS
+
+        Args:
+            td (list): Агрегация сетевого трафика
+            iocs (dict): Словарь IoC
+
+        Returns:
+            tuple[dict, dict]: Соответствие IP -> (тип, имя, свойства) и IoC
+                               без свернутых IP
+        """
+        # IP из графов отмеченных IoC (в т.ч. доменов) не сворачиваются
+        flagged = set()
+        for ioc in iocs.values():
+            if not self._is_flagged(ioc): continue
+            for graph_item in ioc['graph']['objects']:
+                if graph_item['type'] == 'ipv4-addr' and 'name' in graph_item.keys():
+                    flagged.add(graph_item['name'])
+        
+        # IP, к которым обращались по отмеченному домену, тоже не сворачиваются
+        for con in td:
+            dns_ioc = iocs.get(con['dns'])
+            if dns_ioc and self._is_flagged(dns_ioc):
+                flagged.add(con['destination'])
+        
+        rollup = {}
+        for con in td:
+            ip = con['destination']
+            if ip in rollup or ip in flagged: continue
+            
+            ioc = iocs.get(ip)
+            if ioc and self._is_flagged(ioc): continue
+            
+            node = self._rollup_node(ip, ioc)
+            if node: rollup[ip] = node
+        
+        iocs = {k: v for k, v in iocs.items() if k not in rollup}
+        self._logger.info(f'Rolled up {len(rollup)} IPs into {len(set((t, n) for t, n, _ in rollup.values()))} nodes')
+        return rollup, iocs
+    
+    def _parse_traffic_data(self, td: list, nodes: dict, relations: list, str_no_dns: str, rollup=None):
         """Парсинг трафика для поиска связей и первых нод
 
         Args:
@@ -119,14 +222,32 @@ class GraphDB:
             nodes (dict): Ноды
             relations (list): Отношения нод
             str_no_dns (str): Строка для проверки пустого значения DNS
+            rollup (dict, optional): Свертка IP в ноды сетей или AS
         """
         self._logger.info('Parsing traffic data to graph')
+        rollup = rollup if rollup else {}
+        # Агрегированные связи со свернутыми нодами и их IP
+        rolled     = {}
+        rolled_ips = {}
+        
         for con in td:
+            # Нода назначения: IP или нода свертки
+            if con['destination'] in rollup:
+                target_type, target, target_props = rollup[con['destination']]
+                if target not in nodes[target_type].keys():
+                    nodes[target_type][target] = dict(target_props, ips=0)
+                ips = rolled_ips.setdefault((target_type, target), set())
+                if con['destination'] not in ips:
+                    ips.add(con['destination'])
+                    nodes[target_type][target]['ips'] += 1
+            else:
+                target_type, target = 'ip', con['destination']
+                if target not in nodes['ip'].keys(): 
+                    nodes['ip'][target] = {}
+            
             # Обновление списка сущностей
             if con['source'] not in nodes['source'].keys(): 
                 nodes['source'][con['source']] = {}
-            if con['destination'] not in nodes['ip'].keys(): 
-                nodes['ip'][con['destination']] = {}
             if con['dns'] not in nodes['dns'].keys() and con['dns'] != str_no_dns:
                 nodes['dns'][con['dns']] = {}
             
@@ -148,42 +269,74 @@ class GraphDB:
                     }
                 })
                 
-                relations.append({
-                    'source': con['dns'],
-                    'source_type': 'dns',
-                    'target': con['destination'],
-                    'target_type': 'ip',
-                    'name': 'RESOLVES',
-                    'properties': {}
-                })
+                if target_type == 'ip':
+                    relations.append({
+                        'source': con['dns'],
+                        'source_type': 'dns',
+                        'target': target,
+                        'target_type': target_type,
+                        'name': 'RESOLVES',
+                        'properties': {}
+                    })
+                else:
+                    rolled.setdefault(('dns', con['dns'], target), {
+                        'source': con['dns'],
+                        'source_type': 'dns',
+                        'target': target,
+                        'target_type': target_type,
+                        'name': 'RESOLVES',
+                        'properties': {}
+                    })
                 
-            else:
+            elif target_type == 'ip':
                 # Если связь напрямую по IP
                 # То добавляется связь напрямую между хостом и IP
                 relations.append({
                     'source': con['source'],
                     'source_type': 'source',
-                    'target': con['destination'],
-                    'target_type': 'ip',
+                    'target': target,
+                    'target_type': target_type,
                     'name': 'ACCESSES_TO',
                     'properties': {
                         'protocol': con['protocol']
                     }
                 })
+            
+            else:
+                # Связь со свернутой нодой агрегируется по всем IP
+                relation = rolled.setdefault(('source', con['source'], target), {
+                    'source': con['source'],
+                    'source_type': 'source',
+                    'target': target,
+                    'target_type': target_type,
+                    'name': 'ACCESSES_TO',
+                    'properties': {
+                        'protocol': [],
+                        'connection_count': 0
+                    }
+                })
+                props = relation['properties']
+                if con['protocol'] not in props['protocol']:
+                    props['protocol'].append(con['protocol'])
+                props['connection_count'] += con.get('connection_count', 1)
+        
+        relations.extend(rolled.values())
         
         self._logger.info(f'parsed: ip({len(nodes['ip'].keys())}), dns({len(nodes['dns'].keys())}), sources({len(nodes['source'].keys())})')
         self._logger.info(f'parsed relations: {len(relations)}')
         return nodes, relations
                 
-    def _parse_iocs(self, iocs: dict, nodes: dict, relations: list) -> tuple[dict, list]:
+    def _parse_iocs(self, iocs: dict, nodes: dict, relations: list, rollup=None) -> tuple[dict, list]:
         """Функция для добавления в граф информации об IoC
 
         Args:
             iocs (dict): Список IoC
             nodes (dict): Список нод
             relations (list): Отношения нод
+            rollup (dict, optional): Свертка IP в ноды сетей или AS
         """
         self._logger.info('Parsing IoC list')
+        rollup = rollup if rollup else {}
         for object_name, ioc in iocs.items():
             
             # Добавление дополнительной информации в зависимости от типа
@@ -191,9 +344,13 @@ class GraphDB:
             details     = ioc['details']['basic']
             history     = ioc['details']['history']
             graph_ids   = {}
+            # Тип ноды свертки для IP из графа, которые свернуты
+            rolled_ids  = {}
             
             # Основной тип объекта
+            # IoC может прийти без ноды из трафика (например, домен, покрывший IP)
             if type_object == 'ip':
+                nodes['ip'].setdefault(object_name, {})
                 nodes['ip'][object_name]['as_owner']          = details['as_owner']
                 nodes['ip'][object_name]['asn']               = details['asn']
                 nodes['ip'][object_name]['network']           = details['network']
@@ -202,6 +359,7 @@ class GraphDB:
                 nodes['ip'][object_name]['valid_from']        = history['valid_from']
                 nodes['ip'][object_name]['valid_until']       = history['valid_until']
             elif type_object == 'domain':
+                nodes['dns'].setdefault(object_name, {})
                 nodes['dns'][object_name]['top_level_domain'] = details['top_level_domain']    
                 nodes['dns'][object_name]['last_update']      = history['last_update']
                 nodes['dns'][object_name]['uploaded']         = history['uploaded']
@@ -219,6 +377,10 @@ class GraphDB:
                     continue
                 # Если IP - проверить наличие по name
                 elif item_type == 'ipv4-addr':
+                    # Свернутый IP заменяется нодой свертки, а не добавляется повторно
+                    if item_name in rollup:
+                        rolled_ids[item_id], graph_ids[item_id], _ = rollup[item_name]
+                        continue
                     graph_ids[item_id] = item_name
                     if item_name not in nodes['ip'].keys():
                         nodes['ip'][item_name] = {}
@@ -353,6 +515,8 @@ class GraphDB:
                     
                     if s_type == 'analysis-tool' or t_type == 'analysis-tool': continue
                     
+                    s_type = rolled_ids.get(s, s_type)
+                    t_type = rolled_ids.get(t, t_type)
                     s = s if s not in graph_ids.keys() else graph_ids[s]
                     t = t if t not in graph_ids.keys() else graph_ids[t]
                     
@@ -383,6 +547,7 @@ class GraphDB:
                                 elif t_type == 'malware-analysis':
                                     t_type = 'malware_analysis'
                                             
+                                t_type = rolled_ids.get(t, t_type)
                                 t = t if t not in graph_ids.keys() else graph_ids[t]
                                 
                                 relations.append({
@@ -417,19 +582,29 @@ class GraphDB:
             'url':              {},
             'malware':          {},
             'malware_analysis': {},
-            'analysis_tool':    {}
+            'analysis_tool':    {},
+            'network':          {},
+            'asn':              {}
         }
         
         # Список отношений нод
         relations = []
         
-        nodes, relations = self._parse_traffic_data(traffic_data, nodes, relations, str_no_dns)
-        nodes, relations = self._parse_iocs(iocs, nodes, relations)
+        # Свертка IP без угроз
+        rollup = None
+        if self._rollup:
+            rollup, iocs = self._build_rollup(traffic_data, iocs)
+        
+        with self._profiler.stage('parse_traffic_data'):
+            nodes, relations = self._parse_traffic_data(traffic_data, nodes, relations, str_no_dns, rollup)
+        with self._profiler.stage('parse_iocs'):
+            nodes, relations = self._parse_iocs(iocs, nodes, relations, rollup)
         
         # Загрузка в neo4j
-        if clean: self._clean_graph()
-        self._load_nodes(nodes)
-        self._load_relations(relations)
-        self._update_malware_analysis_types(nodes)
+        with self._profiler.stage('load_graph'):
+            if clean: self._clean_graph()
+            self._load_nodes(nodes)
+            self._load_relations(relations)
+            self._update_malware_analysis_types(nodes)
     
     
\ No newline at end of file
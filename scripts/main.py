@@ -8,37 +8,73 @@ from config import *
 from traffic_data import Traffic_data
 from tip import TIP
 from graph_db import GraphDB
+from profiler import Profiler
+from scheduler import Scheduler
+from shards import parse_shards, run_sharded
 
-coloredlogs.install(LOGGING_LEVEL,
-                    fmt=LOGGING_FORMAT)
-logger = logging.getLogger()
+def main():
+    coloredlogs.install(LOGGING_LEVEL,
+                        fmt=LOGGING_FORMAT)
+    logger = logging.getLogger()
 
-logger.info('Initialization of network services')
+    profiler = Profiler(PROFILE_ENABLED,
+                        PROFILE_DIR,
+                        PROFILE_TOP_N,
+                        PROFILE_SAMPLE_INTERVAL)
 
-td = Traffic_data(OPENSEARCH_HOST,
-                  OPENSEARCH_PORT,
-                  OPENSEARCH_AUTH)
-if not td.check_availability():
-    exit(1)
+    # Шарды (индекс, БД); без SHARDS - один шард из OPENSEARCH_INDEX и NEO4J_DB
+    shards = parse_shards(SHARDS) if SHARDS else [(OPENSEARCH_INDEX, NEO4J_DB)]
 
-tip = TIP(TIP_URL, 
-          TIP_AUTH_TOKEN, 
-          TIP_WAIT_TIME)
-if not tip.check_availability():
-    exit(1)
+    logger.info('Initialization of network services')
 
-db = GraphDB(NEO4J_URI, 
-             NEO4J_AUTH, 
-             NEO4J_DB)
-if not db.check_availability():
-    exit(1)
+    td = Traffic_data(OPENSEARCH_HOST,
+                      OPENSEARCH_PORT,
+                      OPENSEARCH_AUTH)
+    if not td.check_availability():
+        exit(1)
 
+    tip = TIP(TIP_URL, 
+              TIP_AUTH_TOKEN, 
+              TIP_WAIT_TIME)
+    if not tip.check_availability():
+        exit(1)
 
-logger.info('Getting aggregated traffic data')
-traffic_data = td.get_last_data(OPENSEARCH_INDEX, PLACEHOLDER_NO_DNS)
+    # Без кэша, бюджета и поиска доменов в первую очередь поиск выполняется
+    # по всему трафику, как раньше
+    scheduler = None
+    if TIP_CACHE_TTL or TIP_TIME_BUDGET or TIP_REQUEST_BUDGET or TIP_DOMAIN_FIRST:
+        scheduler = Scheduler(TIP_STATE_FILE,
+                              TIP_CACHE_TTL,
+                              TIP_TIME_BUDGET,
+                              TIP_REQUEST_BUDGET,
+                              TIP_DOMAIN_FIRST,
+                              TIP_PENDING_TTL)
 
-logger.info('Enrichment traffic with IoCs')
-iocs = tip.enrich_traffic_data(traffic_data, PLACEHOLDER_NO_DNS)
+    for _, db_name in shards:
+        if not GraphDB(NEO4J_URI, NEO4J_AUTH, db_name).check_availability():
+            exit(1)
 
-logger.info('Loading to graph DB obtained data')
-db.load_to_graph(traffic_data, iocs, PLACEHOLDER_NO_DNS)
+    if SHARDS:
+        run_sharded(shards, tip, scheduler, profiler, SHARD_WORKERS or None)
+        return
+
+    logger.info('Getting aggregated traffic data')
+    with profiler.stage('get_last_data'):
+        traffic_data = td.get_traffic(OPENSEARCH_INDEX, PLACEHOLDER_NO_DNS, OPENSEARCH_SUMMARY)
+
+    logger.info('Enrichment traffic with IoCs')
+    with profiler.stage('enrich_traffic_data'):
+        iocs = tip.enrich_traffic_data(traffic_data, PLACEHOLDER_NO_DNS, scheduler)
+
+    logger.info('Loading to graph DB obtained data')
+    db = GraphDB(NEO4J_URI, 
+                 NEO4J_AUTH, 
+                 NEO4J_DB,
+                 profiler=profiler,
+                 rollup=GRAPH_ROLLUP,
+                 rollup_prefix=GRAPH_ROLLUP_PREFIX)
+    db.load_to_graph(traffic_data, iocs, PLACEHOLDER_NO_DNS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# Профилирование этапов загрузки (cProfile, tracemalloc, семплирование стека)
+
+import cProfile, pstats, tracemalloc, threading, sys, os, time, logging
+from collections import Counter
+from contextlib import contextmanager
+
+class Profiler:
+    def __init__(self, enabled=False, out_dir='profiles', top_n=25, sample_interval=0.0,
+                 logger=logging.getLogger("Profiler")):
+        self._enabled  = enabled
+        self._out_dir  = out_dir
+        self._top_n    = top_n
+        self._interval = sample_interval
+        self._logger   = logger
+
+        # Признак активного этапа, вложенные этапы не профилируются
+        self._active = None
+        # Число запусков каждого этапа, чтобы отчеты повторных запусков не перезаписывались
+        self._runs = Counter()
+
+        if self._enabled:
+            os.makedirs(self._out_dir, exist_ok=True)
+            # Трассировка памяти включается один раз, чтобы снимок начала этапа не был пустым
+            if not tracemalloc.is_tracing(): tracemalloc.start()
+            self._logger.info(f'Profiling enabled, output: {self._out_dir}')
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        # Собственные аллокации профилировщика и tracemalloc исключаются из отчета
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__)
+        ])
+
+    def _path(self, stage: str, ext: str) -> str:
+        return os.path.join(self._out_dir, f'{stage}.{ext}')
+
+    def _dump_cprofile(self, stage: str, profile: cProfile.Profile) -> None:
+        """Сохранение статистики cProfile (бинарной и текстовой)
+
+        Args:
+            stage (str): Имя этапа
+            profile (cProfile.Profile): Собранный профиль
+        """
+        profile.dump_stats(self._path(stage, 'prof'))
+        with open(self._path(stage, 'pstats.txt'), 'w') as f:
+            stats = pstats.Stats(profile, stream=f)
+            stats.sort_stats('cumulative').print_stats(self._top_n)
+
+    def _dump_tracemalloc(self, stage: str, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> None:
+        """Сохранение отчета tracemalloc: top-N по итоговому снимку и по разнице снимков
+
+        Args:
+            stage (str): Имя этапа
+            before (tracemalloc.Snapshot): Снимок до начала этапа
+            after (tracemalloc.Snapshot): Снимок по окончании этапа
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        with open(self._path(stage, 'tracemalloc.txt'), 'w') as f:
+            f.write(f'current={current} stage_peak={peak}\n')
+
+            f.write(f'\nTop {self._top_n} allocations:\n')
+            for stat in after.statistics('lineno')[:self._top_n]:
+                f.write(f'{stat}\n')
+
+            f.write(f'\nTop {self._top_n} differences from stage start:\n')
+            for stat in after.compare_to(before, 'lineno')[:self._top_n]:
+                f.write(f'{stat}\n')
+
+    def _sample_stacks(self, thread_id: int, stacks: Counter, stop: threading.Event) -> None:
+        """Семплирование стека потока в формате collapsed-stack
+
+        Args:
+            thread_id (int): Идентификатор профилируемого потока
+            stacks (Counter): Счетчик стеков
+            stop (threading.Event): Событие остановки
+        """
+        while not stop.wait(self._interval):
+            frame = sys._current_frames().get(thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if frames:
+                stacks[';'.join(reversed(frames))] += 1
+
+    def _dump_stacks(self, stage: str, stacks: Counter) -> None:
+        with open(self._path(stage, 'collapsed'), 'w') as f:
+            for stack, count in stacks.items():
+                f.write(f'{stack} {count}\n')
+
+    @contextmanager
+    def stage(self, name: str):
+        """Профилирование этапа. Без включенного профилирования ничего не делает
+
+        Args:
+            name (str): Имя этапа, используется в именах файлов отчетов
+        """
+        if not self._enabled:
+            yield
+            return
+
+        if self._active is not None:
+            self._logger.debug(f'Stage {name} is nested in {self._active}, skipping')
+            yield
+            return
+
+        self._active = name
+        self._runs[name] += 1
+        # Имя отчетов: этап и номер его запуска
+        report = f'{name}.{self._runs[name]}'
+        self._logger.info(f'Profiling stage: {name} (report {report})')
+
+        # Семплирование стека (если задан интервал)
+        stacks  = Counter()
+        stop    = threading.Event()
+        sampler = None
+        if self._interval > 0:
+            sampler = threading.Thread(target=self._sample_stacks,
+                                       args=(threading.get_ident(), stacks, stop),
+                                       daemon=True)
+
+        tracemalloc.reset_peak()
+        before = self._take_snapshot()
+        profile = cProfile.Profile()
+        if sampler: sampler.start()
+        start = time.perf_counter()
+
+        profile.enable()
+        try:
+            yield
+        finally:
+            try:
+                profile.disable()
+                elapsed = time.perf_counter() - start
+                if sampler:
+                    stop.set()
+                    sampler.join()
+                after = self._take_snapshot()
+                self._dump_tracemalloc(report, before, after)
+                self._dump_cprofile(report, profile)
+                if sampler: self._dump_stacks(report, stacks)
+                self._logger.info(f'Stage {name} took {elapsed:.3f}s')
+            finally:
+                # Ошибка сохранения отчета не должна отключать профилирование следующих этапов
+                self._active = None
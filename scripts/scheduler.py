@@ -0,0 +1,226 @@
+# Планирование поиска IoC: приоритет, бюджет и перенос остатка между запусками
+
+import json, os, time, logging, ipaddress
+
+class Scheduler:
+    def __init__(self, state_path: str, cache_ttl=0, time_budget=0, request_budget=0,
+                 domain_first=False, pending_ttl=86400, logger=logging.getLogger("Scheduler")):
+        self._state_path     = state_path
+        self._ttl            = cache_ttl
+        self._time_budget    = time_budget
+        self._request_budget = request_budget
+        self._domain_first   = domain_first
+        self._pending_ttl    = pending_ttl
+        self._logger         = logger
+
+        # Кэш результатов поиска: значение -> {'ioc': ..., 'checked': ...}
+        # IP, покрытые графом домена, хранятся с 'covered_by' и временем проверки домена
+        self._cache   = {}
+        # Отложенные с прошлых запусков значения: значение -> {'priority': ..., 'deferred': ...}
+        self._pending = {}
+        # Приоритеты значений текущего запуска
+        self._priority = {}
+        # Значения, найденные и покрытые в текущем запуске (действуют без учета TTL)
+        self._looked_up = set()
+        self._covered   = {}
+
+        self._started  = None
+        self._requests = 0
+
+        self._load_state()
+
+    def _load_state(self) -> None:
+        """Загрузка кэша и отложенных значений из файла состояния
+        """
+        if not os.path.exists(self._state_path):
+            self._logger.info(f'No state file {self._state_path}, starting clean')
+            return
+        try:
+            with open(self._state_path) as f:
+                state = json.load(f)
+            self._cache   = state.get('cache', {})
+            self._pending = state.get('pending', {})
+            self._expire_pending()
+            self._logger.info(f'Loaded state: cache({len(self._cache)}), pending({len(self._pending)})')
+        except Exception as e:
+            self._logger.error(f'Error while loading state {self._state_path}: {e}')
+
+    def save_state(self) -> None:
+        """Сохранение кэша и отложенных значений в файл состояния
+        """
+        now = time.time()
+        # Просроченные записи не сохраняются
+        cache = {k: v for k, v in self._cache.items() if now - v['checked'] < self._ttl}
+
+        self._expire_pending()
+
+        tmp_path = f'{self._state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'cache': cache, 'pending': self._pending}, f)
+        os.replace(tmp_path, self._state_path)
+        self._logger.info(f'Saved state: cache({len(cache)}), pending({len(self._pending)})')
+
+    def _expire_pending(self) -> None:
+        """Удаление отложенных значений старше `pending_ttl`
+
+        Значение, которое давно не находится в пределах бюджета (или пропало
+        из трафика), не должно бесконечно занимать очередь и файл состояния.
+        """
+        now = time.time()
+        for data in list(self._pending.keys()):
+            entry = self._pending[data]
+            # Формат прежних версий: только приоритет
+            if not isinstance(entry, dict):
+                entry = self._pending[data] = {'priority': entry, 'deferred': now}
+            if now - entry['deferred'] >= self._pending_ttl:
+                del self._pending[data]
+
+    def is_cached(self, data: str) -> bool:
+        if data in self._covered:
+            return True
+        entry = self._cache.get(data)
+        if entry is None or time.time() - entry['checked'] >= self._ttl:
+            return False
+        # Покрытие без графа домена в кэше считается промахом
+        if 'covered_by' in entry:
+            domain = self._cache.get(entry['covered_by'])
+            return domain is not None and domain['ioc'] is not None and 'covered_by' not in domain
+        return True
+    
+    def covered_by(self, data: str) -> str:
+        """Домен, графом которого покрыт IP
+
+        Args:
+            data (str): Значение из кэша
+
+        Returns:
+            str: Доменное имя или `None`, если значение найдено собственным поиском
+        """
+        if data in self._covered:
+            return self._covered[data]
+        return self._cache[data].get('covered_by')
+
+    def get_cached(self, data: str) -> dict:
+        return self._cache[data]['ioc']
+
+    def store(self, data: str, ioc: dict) -> None:
+        """Сохранение результата поиска (в т.ч. пустого) в кэш
+
+        Args:
+            data (str): Значение, по которому выполнялся поиск
+            ioc (dict): Результат поиска или `None`
+        """
+        self._cache[data] = {'ioc': ioc, 'checked': time.time()}
+        self._pending.pop(data, None)
+        self._looked_up.add(data)
+
+    def cover(self, domain: str, ips: list) -> int:
+        """Отметка IP, найденных в графе домена, как не требующих поиска
+
+        В текущем запуске покрытие действует всегда. Между запусками - пока
+        не истек TTL записи домена, после этого IP будут проверены заново.
+        Работает только в режиме `domain_first`.
+
+        Args:
+            domain (str): Доменное имя, по которому получен граф
+            ips (list): IP адреса из графа домена
+
+        Returns:
+            int: Число вновь покрытых IP
+        """
+        if not self._domain_first: return 0
+        
+        checked = self._cache[domain]['checked']
+        covered = 0
+        for ip in ips:
+            if self.is_cached(ip) or ip in self._looked_up: continue
+            self._cache[ip] = {'ioc': None, 'checked': checked, 'covered_by': domain}
+            self._covered[ip] = domain
+            self._pending.pop(ip, None)
+            covered += 1
+        return covered
+    
+    def is_domain(self, data: str) -> bool:
+        try:
+            ipaddress.ip_address(data)
+            return False
+        except ValueError:
+            return True
+
+    def plan(self, traffic_data: list, no_dns_str: str, skip=lambda data: False) -> list:
+        """Составление очереди поиска, отсортированной по приоритету
+
+        Приоритет значения - число соединений, деленное на число уникальных
+        источников: редкие направления с активным трафиком идут первыми.
+        Значения, отложенные с прошлого запуска, добавляют свой приоритет.
+        Закэшированные значения не расходуют бюджет и ставятся в начало.
+        В режиме `domain_first` домены ищутся раньше IP, чтобы их графы
+        покрыли IP адреса.
+
+        Args:
+            traffic_data (list): Агрегированные данные о трафике
+            no_dns_str (str): Строка для проверки пустого значения DNS
+            skip (callable, optional): Признак значения, которое не нужно искать
+
+        Returns:
+            list: Значения для поиска в порядке обработки
+        """
+        connections = {}
+        sources = {}
+        for con in traffic_data:
+            count = con.get('connection_count', 1)
+            values = [con['destination']]
+            if con['dns'] != no_dns_str:
+                values.append(con['dns'])
+            for data in values:
+                connections[data] = connections.get(data, 0) + count
+                sources.setdefault(data, set()).add(con['source'])
+
+        priority = {data: connections[data] / len(sources[data]) for data in connections}
+        for data, entry in self._pending.items():
+            priority[data] = priority.get(data, 0) + entry['priority']
+
+        queue = [data for data in priority if not skip(data)]
+        if self._domain_first:
+            queue.sort(key=lambda data: (not self.is_cached(data), not self.is_domain(data), -priority[data]))
+        else:
+            queue.sort(key=lambda data: (not self.is_cached(data), -priority[data]))
+
+        self._priority = priority
+        self._logger.info(f'Planned {len(queue)} values, cached: {sum(self.is_cached(d) for d in queue)}')
+        return queue
+
+    def start(self) -> None:
+        self._started  = time.monotonic()
+        self._requests = 0
+
+    def has_budget(self) -> bool:
+        """Проверка остатка бюджета на поиск по порталу
+
+        Returns:
+            bool: `True` - если можно выполнить следующий запрос
+        """
+        if self._request_budget and self._requests >= self._request_budget:
+            return False
+        if self._time_budget and time.monotonic() - self._started >= self._time_budget:
+            return False
+        return True
+
+    def spend(self) -> None:
+        self._requests += 1
+
+    def defer(self, queue: list) -> None:
+        """Перенос необработанных значений на следующий запуск
+
+        Args:
+            queue (list): Значения, на которые не хватило бюджета
+                          или поиск которых не завершился
+        """
+        queue = [data for data in queue if not self.is_cached(data)]
+        now = time.time()
+        for data in queue:
+            # Время первого переноса сохраняется, чтобы запись устаревала
+            deferred = self._pending.get(data, {}).get('deferred', now)
+            self._pending[data] = {'priority': self._priority.get(data, 0), 'deferred': deferred}
+        if queue:
+            self._logger.warning(f'Deferred after {self._requests} requests: {len(queue)}')
@@ -0,0 +1,128 @@
+# Параллельная обработка нескольких роутеров (шардов)
+
+import logging, coloredlogs, os
+from concurrent.futures import ProcessPoolExecutor
+
+from config import *
+from traffic_data import Traffic_data
+from graph_db import GraphDB
+from profiler import Profiler
+
+def parse_shards(value: str) -> list:
+    """Разбор списка шардов вида `index_pattern=neo4j_db,...`
+
+    Args:
+        value (str): Строка с описанием шардов
+
+    Raises:
+        ValueError: При неверном формате шарда или повторе БД
+
+    Returns:
+        list: Список кортежей (шаблон индекса, имя БД)
+    """
+    shards = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item: continue
+        if '=' not in item:
+            raise ValueError(f'Bad shard "{item}", expected index_pattern=neo4j_db')
+        index, db = item.split('=', 1)
+        shards.append((index.strip(), db.strip()))
+    
+    # Загрузка шарда очищает граф, поэтому БД не должны повторяться
+    dbs = [db for _, db in shards]
+    if len(dbs) != len(set(dbs)):
+        raise ValueError('Neo4j databases of shards must be unique')
+    return shards
+
+def _init_worker() -> None:
+    coloredlogs.install(LOGGING_LEVEL,
+                        fmt=LOGGING_FORMAT)
+
+def _get_profiler(db_name: str) -> Profiler:
+    # Отчеты шарда сохраняются в отдельный каталог, чтобы не перезаписывать друг друга
+    return Profiler(PROFILE_ENABLED,
+                    os.path.join(PROFILE_DIR, db_name),
+                    PROFILE_TOP_N,
+                    PROFILE_SAMPLE_INTERVAL)
+
+def _fetch_shard(index: str, db_name: str) -> list:
+    td = Traffic_data(OPENSEARCH_HOST,
+                      OPENSEARCH_PORT,
+                      OPENSEARCH_AUTH,
+                      logger=logging.getLogger(f'traffic_data[{index}]'))
+    with _get_profiler(db_name).stage('get_last_data'):
+        return td.get_traffic(index, PLACEHOLDER_NO_DNS, OPENSEARCH_SUMMARY)
+
+def _load_shard(db_name: str, traffic_data: list, iocs: dict) -> None:
+    db = GraphDB(NEO4J_URI,
+                 NEO4J_AUTH,
+                 db_name,
+                 logger=logging.getLogger(f'GraphDB[{db_name}]'),
+                 profiler=_get_profiler(db_name),
+                 rollup=GRAPH_ROLLUP,
+                 rollup_prefix=GRAPH_ROLLUP_PREFIX)
+    db.load_to_graph(traffic_data, iocs, PLACEHOLDER_NO_DNS)
+
+def _shard_iocs(traffic_data: list, iocs: dict) -> dict:
+    """Выборка IoC, относящихся к трафику шарда
+
+    Args:
+        traffic_data (list): Трафик шарда
+        iocs (dict): IoC по всем шардам
+
+    Returns:
+        dict: IoC шарда
+    """
+    shard = {}
+    for con in traffic_data:
+        for data in (con['destination'], con['dns']):
+            if data in iocs:
+                shard[data] = iocs[data]
+    
+    # IP без собственного IoC, покрытые графом домена из другого шарда
+    uncovered = set(con['destination'] for con in traffic_data) - shard.keys()
+    for data, ioc in iocs.items():
+        if data in shard or 'graph' not in ioc: continue
+        for graph_item in ioc['graph']['objects']:
+            if graph_item['type'] == 'ipv4-addr' and graph_item.get('name') in uncovered:
+                shard[data] = ioc
+                break
+    return shard
+
+def run_sharded(shards: list, tip, scheduler, profiler, workers=None,
+                logger=logging.getLogger("shards")) -> None:
+    """Обработка шардов: параллельное получение трафика, общий поиск IoC,
+    параллельная загрузка в графовые БД шардов
+
+    Поиск IoC выполняется в основном процессе по объединенному трафику,
+    поэтому значение, встреченное на нескольких роутерах, ищется один раз.
+
+    Args:
+        shards (list): Список кортежей (шаблон индекса, имя БД)
+        tip (TIP): Клиент портала TIP
+        scheduler (Scheduler, optional): Планировщик поиска с кэшем IoC
+        profiler (Profiler): Профилировщик этапа поиска IoC в основном процессе
+        workers (int, optional): Число процессов, по умолчанию - число ядер
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        # Получение трафика и загрузка профилируются в процессах шардов
+        logger.info(f'Getting aggregated traffic data for {len(shards)} shards')
+        traffic = list(pool.map(_fetch_shard,
+                                [index for index, _ in shards],
+                                [db_name for _, db_name in shards]))
+
+        logger.info('Enrichment traffic with IoCs')
+        with profiler.stage('enrich_traffic_data'):
+            all_traffic = [con for shard_traffic in traffic for con in shard_traffic]
+            iocs = tip.enrich_traffic_data(all_traffic, PLACEHOLDER_NO_DNS, scheduler)
+
+        logger.info('Loading to graph DBs obtained data')
+        futures = []
+        for (index, db_name), shard_traffic in zip(shards, traffic):
+            futures.append(pool.submit(_load_shard,
+                                       db_name,
+                                       shard_traffic,
+                                       _shard_iocs(shard_traffic, iocs)))
+        for future in futures:
+            future.result()
@@ -1,5 +1,8 @@
 import requests, time, logging
 
+class TIPTimeoutError(Exception):
+    """Поиск не завершился за отведенное число проверок"""
+
 class TIP:
     def __init__(self, url, token, wait_time=0.5, logger=logging.getLogger("TIP")):
         self._url = url
@@ -39,9 +42,10 @@ class TIP:
 
         Raises:
             Exception: При ошибке выполнения запросов
+            TIPTimeoutError: При долгом ожидании результата поиска
 
         Returns:
-            dict: Данные об IoC
+            dict: Данные об IoC, `None` - если IoC не найден
         """
         self._logger.info(f'Search IoC for: {data}')
         
@@ -70,7 +74,7 @@ class TIP:
         while True:
             if safe_counter == 0:
                 self._logger.error('Long await, getting next IoC')
-                return None
+                raise TIPTimeoutError(data)
             
             safe_counter -= 1
             # Ожидание выполнения поиска
@@ -107,28 +111,43 @@ class TIP:
                 raise Exception('Bad status code')
     
     
+    def _is_local(self, data: str) -> bool:
+        return "192.168" in data
+    
+    def _graph_ips(self, ioc: dict) -> list:
+        return [item['name'] for item in ioc['graph']['objects']
+                if item['type'] == 'ipv4-addr' and 'name' in item.keys()]
+    
     def _add_ioc(self, data, iocs) -> dict:
         # Если локальный адрес
-        if "192.168" in data: return
+        if self._is_local(data): return
         # Если уже выполнялся поиск
         if data in iocs.keys(): return
         
-        ioc = self.search_ioc(data)
+        try:
+            ioc = self.search_ioc(data)
+        except TIPTimeoutError:
+            return
         if ioc != None: 
             self._logger.debug(f'Adding {data} to iocs')
             iocs[data] = ioc
         
-    def enrich_traffic_data(self, traffic_data: list, no_dns_str: str) -> dict:
+    def enrich_traffic_data(self, traffic_data: list, no_dns_str: str, scheduler=None) -> dict:
         """Обогащение данных о сетевом траффике при помощи портала TIP
 
         Args:
             traffic_data (list): Агрегированные данные о трафике
+            scheduler (Scheduler, optional): Планировщик поиска. Если задан,
+                значения ищутся по приоритету в пределах бюджета запуска
 
         Returns:
             dict: Словарь с IoC, где ключ - это и есть элемент, а значение -
                   полученные данные
         """
         
+        if scheduler is not None:
+            return self._enrich_scheduled(traffic_data, no_dns_str, scheduler)
+        
         iocs = {}
         for con in traffic_data:
             dns = con['dns']
@@ -143,4 +162,66 @@ class TIP:
             # Поиск IoC на IP адрес
             self._add_ioc(ip, iocs)
         
-        return iocs
\ No newline at end of file
+        return iocs
+    
+    def _enrich_scheduled(self, traffic_data: list, no_dns_str: str, scheduler) -> dict:
+        """Обогащение по очереди планировщика с учетом кэша и бюджета
+
+        Args:
+            traffic_data (list): Агрегированные данные о трафике
+            no_dns_str (str): Строка для проверки пустого значения DNS
+            scheduler (Scheduler): Планировщик поиска
+
+        Returns:
+            dict: Словарь с IoC для значений из текущего трафика
+        """
+        # Значения, присутствующие в текущем трафике
+        current = set()
+        for con in traffic_data:
+            current.add(con['destination'])
+            if con['dns'] != no_dns_str:
+                current.add(con['dns'])
+        
+        queue = scheduler.plan(traffic_data, no_dns_str, skip=self._is_local)
+        scheduler.start()
+        
+        iocs = {}
+        try:
+            for i, data in enumerate(queue):
+                if scheduler.is_cached(data):
+                    ioc = scheduler.get_cached(data)
+                    # Покрытый IP получает контекст из графа своего домена,
+                    # даже если домена нет в текущем трафике
+                    domain = scheduler.covered_by(data)
+                    if domain and data in current:
+                        self._logger.debug(f'{data} is covered by {domain}')
+                        iocs[domain] = scheduler.get_cached(domain)
+                elif scheduler.has_budget():
+                    scheduler.spend()
+                    try:
+                        ioc = self.search_ioc(data)
+                    except TIPTimeoutError:
+                        # Таймаут не означает отсутствие IoC: не кэшируется, переносится
+                        scheduler.defer([data])
+                        continue
+                    scheduler.store(data, ioc)
+                else:
+                    self._logger.warning('Lookup budget exhausted')
+                    # Закэшированные (в т.ч. покрытые доменами) значения не переносятся
+                    scheduler.defer(queue[i:])
+                    break
+                
+                # IP из графа домена не требуют отдельного поиска
+                if ioc != None and scheduler.is_domain(data):
+                    covered = scheduler.cover(data, self._graph_ips(ioc))
+                    if covered: self._logger.debug(f'{data} covers {covered} IPs')
+            
+                # Значения с прошлых запусков только кэшируются
+                if ioc != None and data in current:
+                    self._logger.debug(f'Adding {data} to iocs')
+                    iocs[data] = ioc
+        finally:
+            # Состояние сохраняется и при ошибке портала
+            scheduler.save_state()
+        
+        return iocs
@@ -1,6 +1,6 @@
 # Для получения данных из Opensearch
 
-from opensearchpy import OpenSearch
+from opensearchpy import OpenSearch, helpers
 import logging
 
 class Traffic_data:
@@ -47,7 +47,8 @@ class Traffic_data:
         :param no_dns_str: Текст для отметки об отсутствии DNS записи
         :type no_dns_str: str
         :param gte: Временная отметка для получения данных
-        :return: Список словарей с ключами: `source`, `destinaion`, `protocol`, `dns`
+        :return: Список словарей с ключами: `source`, `destinaion`, `protocol`, `dns`,
+                 `connection_count`, `first_seen`, `last_seen`
         :rtype: list
         """
 
@@ -115,12 +116,95 @@ class Traffic_data:
         for connection in buckets:
             k = connection['key']
             data.append({
-                'source':      k[0],
-                'destination': k[1],
-                'dns':         k[2],
-                'protocol':    k[3]
+                'source':           k[0],
+                'destination':      k[1],
+                'dns':              k[2],
+                'protocol':         k[3],
+                'connection_count': connection['connection_count']['value'],
+                'first_seen':       connection['first_seen'].get('value_as_string'),
+                'last_seen':        connection['last_seen'].get('value_as_string')
             })
             
         self._logger.debug(f'Total values: {len(data)}')
         
         return data
+
+    def get_last_summary(self, index: str, no_dns_str: str, gte='now-30m') -> list:
+        """
+        Получение данных по трафику из индекса сводки соединений, который
+        ведет Logstash (один документ на соединение за 5 минут)
+        
+        Документы отбираются по началу интервала (`bucket`), поэтому окно
+        совпадает с `get_last_data` с точностью до одного интервала (5 минут).
+        
+        :param self: Экземпляр класса
+        :param index: Индекс сводки соединений
+        :type index: str
+        :param no_dns_str: Текст для отметки об отсутствии DNS записи
+        :type no_dns_str: str
+        :param gte: Временная отметка для получения данных
+        :return: Список словарей в формате `get_last_data`
+        :rtype: list
+        """
+        
+        client = self._get_opensearch()
+        
+        query = {
+            "query": {
+                "bool": {
+                    "filter": [
+                        {
+                            "range": {
+                                "bucket": {
+                                    "gte": gte,
+                                    "lte": "now"
+                                }
+                            }
+                        }
+                    ]
+                }
+            }
+        }
+        
+        # Объединение документов одного соединения за разные интервалы
+        connections = {}
+        for hit in helpers.scan(client, index=index, query=query):
+            doc = hit['_source']
+            key = (doc['source'], doc['destination'], doc.get('dns') or no_dns_str, doc['event_type'])
+            
+            if key not in connections:
+                connections[key] = {
+                    'source':           key[0],
+                    'destination':      key[1],
+                    'dns':              key[2],
+                    'protocol':         key[3],
+                    'connection_count': doc['count'],
+                    'first_seen':       doc['first_seen'],
+                    'last_seen':        doc['last_seen']
+                }
+                continue
+            
+            con = connections[key]
+            con['connection_count'] += doc['count']
+            con['first_seen'] = min(con['first_seen'], doc['first_seen'])
+            con['last_seen']  = max(con['last_seen'], doc['last_seen'])
+        
+        data = list(connections.values())
+        self._logger.debug(f'Total values: {len(data)}')
+        
+        return data
+    
+    def get_traffic(self, index: str, no_dns_str: str, summary=False) -> list:
+        """Получение данных по трафику из сырых событий или из сводки соединений
+
+        Args:
+            index (str): Индекс для получения данных
+            no_dns_str (str): Текст для отметки об отсутствии DNS записи
+            summary (bool, optional): `True` - индекс является сводкой соединений
+
+        Returns:
+            list: Список словарей с данными о соединениях
+        """
+        if summary:
+            return self.get_last_summary(index, no_dns_str)
+        return self.get_last_data(index, no_dns_str)